@@ -1,15 +1,33 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import requests
+import httpx
+from cachetools import TTLCache
+import asyncio
 import json
+import logging
+import logging.handlers
+from queue import SimpleQueue
+import orjson
 import os
+import re
+import secrets
+import sys
 import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Logging - records are formatted on the calling thread, then queued and written to stdout
+# by a background listener thread, so request handlers never block on the stream write
+logger = logging.getLogger("deepshare")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue = SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+
 app = FastAPI(title="Deepshare IPFS Service")
 
 # CORS middleware
@@ -39,54 +57,109 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Supabase credentials not found in environment variables")
 
 
-def upload_to_ipfs(file_data: bytes, filename: str, metadata: dict) -> str:
-    """
-    Upload file and metadata to IPFS via Pinata
-    Returns the IPFS CID
-    """
-    # Prepare files for Pinata
-    files = {
-        'file': (filename, file_data, 'application/octet-stream')
+# Pinata auth headers - use API Key/Secret if available (more reliable), otherwise use JWT
+# Content-Type is left unset so httpx can add the multipart/form-data boundary
+if PINATA_API_KEY and PINATA_SECRET_KEY:
+    _PINATA_AUTH_HEADERS = {
+        "pinata_api_key": PINATA_API_KEY,
+        "pinata_secret_api_key": PINATA_SECRET_KEY
     }
-    
-    # Prepare metadata as JSON
-    pinata_metadata = {
-        "name": filename,
-        "keyvalues": metadata
+else:
+    _PINATA_AUTH_HEADERS = {
+        "Authorization": f"Bearer {PINATA_JWT}"
     }
+
+# Pinning options sent with every Pinata upload (serialized once)
+_PINATA_OPTIONS = orjson.dumps({"cidVersion": 1})
+
+# Characters not allowed in filenames built from client input (multipart headers, generated names)
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+# Chunk size for streaming uploaded files to Pinata
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Precomputed multipart/form-data parts for Pinata uploads
+_MULTIPART_BOUNDARY = secrets.token_hex(16)
+_MULTIPART_DELIMITER = f"--{_MULTIPART_BOUNDARY}\r\n".encode("ascii")
+_MULTIPART_OPTIONS_PART = (
+    _MULTIPART_DELIMITER
+    + b'Content-Disposition: form-data; name="pinataOptions"\r\n\r\n'
+    + _PINATA_OPTIONS
+    + b"\r\n"
+)
+_MULTIPART_END = f"\r\n--{_MULTIPART_BOUNDARY}--\r\n".encode("ascii")
+_PINATA_MULTIPART_HEADERS = {
+    **_PINATA_AUTH_HEADERS,
+    "Content-Type": f"multipart/form-data; boundary={_MULTIPART_BOUNDARY}"
+}
+
+# Cache of registered devices for /check-registration (wallet_address -> device records)
+REGISTRATION_CACHE_SIZE = 10_000
+REGISTRATION_CACHE_TTL = 60
+_registration_cache = TTLCache(maxsize=REGISTRATION_CACHE_SIZE, ttl=REGISTRATION_CACHE_TTL)
+
+# Batching of Supabase inserts (max rows per request, seconds to wait for more rows)
+SUPABASE_BATCH_SIZE = 100
+SUPABASE_BATCH_WINDOW = 0.05
+
+# Supabase REST auth headers, sent with every Supabase request
+_SUPABASE_HEADERS = {
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}",
+}
+
+# Supabase images table endpoint (resolved on startup, see _resolve_images_url)
+_IMAGES_URL = f"{SUPABASE_URL}/rest/v1/images"
+
+# Headers for inserts - return=minimal skips sending the inserted rows back
+_SUPABASE_INSERT_HEADERS = {
+    **_SUPABASE_HEADERS,
+    "Content-Type": "application/json",
+    "Prefer": "return=minimal"
+}
+
+
+@app.on_event("startup")
+async def startup():
+    _log_listener.start()
     
-    # Use API Key/Secret if available (more reliable), otherwise use JWT
-    if PINATA_API_KEY and PINATA_SECRET_KEY:
-        headers = {
-            "pinata_api_key": PINATA_API_KEY,
-            "pinata_secret_api_key": PINATA_SECRET_KEY
-        }
-    elif PINATA_JWT:
-        headers = {
-            "Authorization": f"Bearer {PINATA_JWT}"
-        }
-    else:
-        raise ValueError("No Pinata credentials available")
+    # Shared async HTTP client for Pinata and Supabase (keep-alive, HTTP/2 multiplexing)
+    # Created here so it is bound to the running event loop
+    app.state.http = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+            retries=3
+        ),
+        timeout=httpx.Timeout(60.0)
+    )
     
-    data = {
-        "pinataMetadata": json.dumps(pinata_metadata),
-        "pinataOptions": json.dumps({
-            "cidVersion": 1
-        })
-    }
+    await _resolve_images_url()
     
+    # Background writer for batched Supabase inserts
+    app.state.supabase_queue = asyncio.Queue()
+    app.state.supabase_writer = asyncio.create_task(_supabase_writer())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.supabase_writer.cancel()
     try:
-        # Don't set Content-Type header - requests library will set it automatically for multipart/form-data
-        # Remove Content-Type if it exists to let requests handle it
-        upload_headers = {k: v for k, v in headers.items() if k.lower() != 'content-type'}
-        
-        response = requests.post(
-            PINATA_API_URL,
-            files=files,
-            data=data,
-            headers=upload_headers,
-            timeout=60
-        )
+        await app.state.supabase_writer
+    except asyncio.CancelledError:
+        pass
+    await _flush_supabase_queue()
+    await app.state.http.aclose()
+    _log_listener.stop()
+
+
+async def _pin_to_ipfs(**request_kwargs) -> str:
+    """
+    POST an upload to Pinata's pinFileToIPFS endpoint
+    Returns the IPFS CID
+    """
+    try:
+        response = await app.state.http.post(PINATA_API_URL, **request_kwargs)
         
         # Better error handling
         if response.status_code != 200:
@@ -110,77 +183,256 @@ def upload_to_ipfs(file_data: bytes, filename: str, metadata: dict) -> str:
             raise ValueError("No IPFS hash returned from Pinata")
         
         # Log the CID
-        print(f"✅ Pinata upload successful - CID: {ipfs_hash}")
+        logger.info("✅ Pinata upload successful - CID: %s", ipfs_hash)
         
         return ipfs_hash
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Pinata upload failed: {str(e)}")
 
 
-def store_in_supabase(wallet_address: str, image_cid: str, metadata_cid: str):
+async def _pin_multipart(filename: str, pinata_metadata: bytes, chunks, size: int) -> str:
+    """
+    Upload a file to IPFS via Pinata as a multipart body assembled from precomputed parts
+    The file content comes from the async iterable chunks (size bytes in total) and is streamed as it is read
+    filename is kept as-is in pinataMetadata; only the part header gets a filename-safe copy
+    Returns the IPFS CID
+    """
+    # The filename can be client input - the part header only gets a filename-safe copy
+    part_filename = _UNSAFE_FILENAME_CHARS.sub("_", filename)
+    head = b"".join([
+        _MULTIPART_DELIMITER,
+        b'Content-Disposition: form-data; name="pinataMetadata"\r\n\r\n',
+        pinata_metadata,
+        b"\r\n",
+        _MULTIPART_OPTIONS_PART,
+        _MULTIPART_DELIMITER,
+        f'Content-Disposition: form-data; name="file"; filename="{part_filename}"\r\n'.encode("ascii"),
+        b"Content-Type: application/octet-stream\r\n\r\n",
+    ])
+    
+    async def body():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+        yield _MULTIPART_END
+    
+    headers = {
+        **_PINATA_MULTIPART_HEADERS,
+        "Content-Length": str(len(head) + size + len(_MULTIPART_END))
+    }
+    return await _pin_to_ipfs(content=body(), headers=headers)
+
+
+async def upload_to_ipfs(upload: UploadFile, filename: str, metadata: dict) -> str:
+    """
+    Upload an uploaded file and metadata to IPFS via Pinata
+    The file is read in chunks without blocking the event loop and streamed as it is read
+    Returns the IPFS CID
+    """
+    # Keyvalues can hold client metadata - the stdlib keeps NaN/Infinity and big integers intact
+    pinata_metadata = json.dumps({
+        "name": filename,
+        "keyvalues": metadata
+    }).encode("utf-8")
+    
+    size = upload.size
+    if size is None:
+        size = upload.file.seek(0, os.SEEK_END)
+    await upload.seek(0)
+    
+    async def chunks():
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+    
+    return await _pin_multipart(filename, pinata_metadata, chunks(), size)
+
+
+async def upload_json_to_ipfs(payload: bytes, filename: str, metadata: dict) -> str:
+    """
+    Upload an in-memory JSON payload and metadata to IPFS via Pinata
+    The payload is streamed without being copied into a combined body
+    Returns the IPFS CID
+    """
+    pinata_metadata = orjson.dumps({
+        "name": filename,
+        "keyvalues": metadata
+    })
+    
+    async def chunks():
+        yield payload
+    
+    return await _pin_multipart(filename, pinata_metadata, chunks(), len(payload))
+
+
+async def store_in_supabase(wallet_address: str, image_cid: str, metadata_cid: str):
+    """
+    Store wallet_address, image_cid, and metadata_cid in the Supabase images table
+    Rows from concurrent requests are coalesced into one insert by the background writer;
+    this waits for the batch and raises if the insert failed
+    """
+    # Normalize wallet address to lowercase for consistency
+    # (Ethereum addresses are case-insensitive, but Supabase string comparison is case-sensitive)
+    row = {
+        "wallet_address": wallet_address.lower(),
+        "image_cid": image_cid,
+        "metadata_cid": metadata_cid
+    }
+    done = asyncio.get_running_loop().create_future()
+    app.state.supabase_queue.put_nowait((row, done))
+    await done
+
+
+async def _resolve_images_url():
+    """
+    Find which spelling of the images table Supabase exposes (Supabase can be case-sensitive)
+    Probed once on startup - inserts then use _IMAGES_URL directly
+    """
+    global _IMAGES_URL
+    candidates = [f"{SUPABASE_URL}/rest/v1/images", f"{SUPABASE_URL}/rest/v1/\"images\""]
+    for url in candidates:
+        try:
+            response = await app.state.http.get(
+                url,
+                headers=_SUPABASE_HEADERS,
+                params={"select": "image_cid", "limit": "0"},
+                timeout=10
+            )
+        except httpx.HTTPError as e:
+            logger.warning("⚠ Could not probe Supabase images table: %s", e)
+            return
+        if response.status_code == 200:
+            _IMAGES_URL = url
+            return
+    logger.warning("⚠ Could not resolve Supabase images table (status %s), using %s", response.status_code, _IMAGES_URL)
+
+
+class _RowsRejected(HTTPException):
+    """Supabase answered an insert with a 4xx - possibly caused by a single row of the batch"""
+
+
+async def _insert_images(rows: list):
     """
-    Store wallet_address, image_cid, and metadata_cid in Supabase images table using REST API
+    Insert a batch of rows into the Supabase images table in a single REST API request
+    (PostgREST treats a JSON array body as a multi-row insert)
     """
     try:
-        # Normalize wallet address to lowercase for consistency
-        # (Ethereum addresses are case-insensitive, but Supabase string comparison is case-sensitive)
-        wallet_address_lower = wallet_address.lower()
-        
-        # Try both lowercase and quoted table name (Supabase can be case-sensitive)
-        url = f"{SUPABASE_URL}/rest/v1/images"
-        headers = {
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
-        data = {
-            "wallet_address": wallet_address_lower,
-            "image_cid": image_cid,
-            "metadata_cid": metadata_cid
-        }
-        
-        response = requests.post(url, json=data, headers=headers, timeout=10)
-        
-        # If 401, try with quoted table name
-        if response.status_code == 401:
-            print(f"⚠ First attempt failed with 401, trying with quoted table name...")
-            url = f"{SUPABASE_URL}/rest/v1/\"images\""
-            response = requests.post(url, json=data, headers=headers, timeout=10)
-        
-        # Better error handling
-        if response.status_code == 401:
-            error_msg = "Supabase authentication failed (401 Unauthorized)"
-            try:
-                error_json = response.json()
-                error_msg += f": {error_json.get('message', response.text)}"
-            except:
-                error_msg += f": Check your SUPABASE_KEY - it may be invalid, expired, or RLS policies are blocking"
-            print(f"❌ Supabase error: {error_msg}")
-            raise HTTPException(status_code=401, detail=error_msg)
-        
-        if response.status_code == 404:
-            error_msg = "Supabase table 'images' not found. Make sure the table exists and is accessible."
-            print(f"❌ Supabase error: {error_msg}")
-            raise HTTPException(status_code=404, detail=error_msg)
-        
-        response.raise_for_status()
-        
-        result = response.json()
-        print(f"✅ Supabase insert successful")
-        return result
-    except HTTPException:
-        raise
-    except requests.exceptions.RequestException as e:
-        error_detail = str(e)
-        if hasattr(e, 'response') and e.response is not None:
-            try:
-                error_json = e.response.json()
-                error_detail = json.dumps(error_json, indent=2)
-            except:
-                error_detail = e.response.text
-        print(f"❌ Supabase error: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"Supabase insert failed: {error_detail}")
+        response = await app.state.http.post(
+            _IMAGES_URL,
+            content=orjson.dumps(rows),
+            headers=_SUPABASE_INSERT_HEADERS,
+            timeout=10
+        )
+    except httpx.HTTPError as e:
+        logger.error("❌ Supabase error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Supabase insert failed: {str(e)}")
+    
+    # Better error handling
+    if response.status_code == 401:
+        error_msg = "Supabase authentication failed (401 Unauthorized)"
+        try:
+            error_json = response.json()
+            error_msg += f": {error_json.get('message', response.text)}"
+        except:
+            error_msg += f": Check your SUPABASE_KEY - it may be invalid, expired, or RLS policies are blocking"
+        logger.error("❌ Supabase error: %s", error_msg)
+        raise _RowsRejected(status_code=401, detail=error_msg)
+    
+    if response.status_code == 404:
+        error_msg = "Supabase table 'images' not found. Make sure the table exists and is accessible."
+        logger.error("❌ Supabase error: %s", error_msg)
+        raise _RowsRejected(status_code=404, detail=error_msg)
+    
+    if response.status_code not in (200, 201):
+        error_detail = response.text
+        try:
+            error_json = response.json()
+            error_detail = json.dumps(error_json, indent=2)
+        except:
+            pass
+        logger.error("❌ Supabase error: %s", error_detail)
+        error_type = _RowsRejected if 400 <= response.status_code < 500 else HTTPException
+        raise error_type(status_code=500, detail=f"Supabase insert failed: {error_detail}")
+
+
+def _fail_supabase_batch(batch: list, error: Exception):
+    """Fail every pending future of a batch, each with its own exception instance"""
+    for _, done in batch:
+        if done.done():
+            continue
+        if isinstance(error, HTTPException):
+            done.set_exception(HTTPException(status_code=error.status_code, detail=error.detail))
+        else:
+            done.set_exception(HTTPException(status_code=500, detail=f"Supabase insert failed: {str(error)}"))
+
+
+async def _write_supabase_batch(batch: list):
+    """
+    Insert a batch of (row, future) pairs and resolve every future with the outcome
+    The insert is atomic, so if Supabase rejects a multi-row batch the rows are retried
+    one by one - each request then gets the result of its own row
+    """
+    try:
+        await _insert_images([row for row, _ in batch])
+    except _RowsRejected as e:
+        if len(batch) > 1:
+            logger.warning("⚠ Supabase rejected a batch of %d rows, retrying them individually", len(batch))
+            await asyncio.gather(*(_write_supabase_batch([item]) for item in batch))
+            return
+        _fail_supabase_batch(batch, e)
+        return
+    except Exception as e:
+        _fail_supabase_batch(batch, e)
+        return
+    
+    logger.info("✅ Supabase insert successful (%d row(s))", len(batch))
+    for _, done in batch:
+        if not done.done():
+            done.set_result(None)
+
+
+async def _collect_supabase_batch(pending: asyncio.Queue, batch: list):
+    """
+    Wait for a queued row, then collect more into batch until it is full or the batch window closes
+    """
+    loop = asyncio.get_running_loop()
+    batch.append(await pending.get())
+    deadline = loop.time() + SUPABASE_BATCH_WINDOW
+    while len(batch) < SUPABASE_BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(pending.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+
+
+async def _supabase_writer():
+    """
+    Background task that coalesces queued rows into multi-row Supabase inserts
+    """
+    pending = app.state.supabase_queue
+    while True:
+        batch = []
+        try:
+            await _collect_supabase_batch(pending, batch)
+            await _write_supabase_batch(batch)
+        except asyncio.CancelledError:
+            # Shutting down - put unwritten rows back so the final flush picks them up
+            for item in batch:
+                if not item[1].done():
+                    pending.put_nowait(item)
+            raise
+
+
+async def _flush_supabase_queue():
+    """Insert any rows still queued (used on shutdown)"""
+    pending = app.state.supabase_queue
+    batch = []
+    while not pending.empty():
+        batch.append(pending.get_nowait())
+    if batch:
+        await _write_supabase_batch(batch)
 
 
 @app.get("/")
@@ -193,6 +445,50 @@ async def health():
     return {"status": "healthy"}
 
 
+async def _fetch_device_records(wallet_address_lower: str) -> list:
+    """
+    Look up a (lowercased) wallet_address in the Supabase Devices table
+    Registered devices are cached for REGISTRATION_CACHE_TTL seconds; misses are not cached,
+    so a device that has just registered is seen on its next check
+    Returns the matching device records
+    """
+    data = _registration_cache.get(wallet_address_lower)
+    if data:
+        return data
+    
+    # Try both table name variations (case-sensitive)
+    table_names = ["Devices", "devices"]
+    data = []
+    
+    for table_name in table_names:
+        url = f"{SUPABASE_URL}/rest/v1/{table_name}"
+        headers = {
+            **_SUPABASE_HEADERS,
+            "Content-Type": "application/json",
+        }
+        params = {
+            "wallet_address": f"eq.{wallet_address_lower}",
+            "select": "wallet_address"
+        }
+        
+        try:
+            response = await app.state.http.get(url, headers=headers, params=params, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+            if data:  # If we got results, use this table name
+                break
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                # Table not found, try next variation
+                continue
+            else:
+                raise
+    
+    if data:
+        _registration_cache[wallet_address_lower] = data
+    return data
+
+
 @app.get("/check-registration/{wallet_address}")
 async def check_registration(wallet_address: str):
     """
@@ -203,45 +499,19 @@ async def check_registration(wallet_address: str):
         # (Ethereum addresses are case-insensitive, but Supabase string comparison is case-sensitive)
         wallet_address_lower = wallet_address.lower()
         
-        # Try both table name variations (case-sensitive)
-        table_names = ["Devices", "devices"]
-        data = []
-        
-        for table_name in table_names:
-            url = f"{SUPABASE_URL}/rest/v1/{table_name}"
-            headers = {
-                "apikey": SUPABASE_KEY,
-                "Authorization": f"Bearer {SUPABASE_KEY}",
-                "Content-Type": "application/json",
-            }
-            params = {
-                "wallet_address": f"eq.{wallet_address_lower}",
-                "select": "wallet_address"
-            }
-            
-            try:
-                response = requests.get(url, headers=headers, params=params, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                if data:  # If we got results, use this table name
-                    break
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 404:
-                    # Table not found, try next variation
-                    continue
-                else:
-                    raise
+        data = await _fetch_device_records(wallet_address_lower)
         
         is_registered = len(data) > 0
         
         # Debug logging
-        print(f"🔍 Check registration for {wallet_address} (normalized: {wallet_address_lower}):")
-        print(f"   Supabase response: {len(data)} record(s) found")
-        print(f"   Registered: {is_registered}")
-        if data:
-            print(f"   Data: {data}")
-        elif not data:
-            print(f"   ⚠️  No device found with wallet_address: {wallet_address_lower}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔍 Check registration for %s (normalized: %s):", wallet_address, wallet_address_lower)
+            logger.debug("   Supabase response: %d record(s) found", len(data))
+            logger.debug("   Registered: %s", is_registered)
+            if data:
+                logger.debug("   Data: %s", data)
+            else:
+                logger.debug("   ⚠️  No device found with wallet_address: %s", wallet_address_lower)
         
         return JSONResponse(
             status_code=200,
@@ -250,8 +520,8 @@ async def check_registration(wallet_address: str):
                 "wallet_address": wallet_address
             }
         )
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Registration check error: {str(e)}")
+    except httpx.HTTPError as e:
+        logger.error("❌ Registration check error: %s", e)
         raise HTTPException(status_code=500, detail=f"Registration check failed: {str(e)}")
 
 
@@ -270,9 +540,6 @@ async def upload_capture(
     - metadata: JSON string containing depth information and other metadata
     """
     try:
-        # Read image file
-        image_data = await image.read()
-        
         # Parse metadata
         try:
             metadata_dict = json.loads(metadata)
@@ -284,10 +551,10 @@ async def upload_capture(
         
         # Upload to IPFS
         filename = image.filename or f"capture_{wallet_address[:10]}.jpg"
-        cid = upload_to_ipfs(image_data, filename, metadata_dict)
+        cid = await upload_to_ipfs(image, filename, metadata_dict)
         
         # Store in Supabase (for /upload endpoint, use same CID for both image and metadata)
-        store_in_supabase(wallet_address, cid, cid)
+        await store_in_supabase(wallet_address, cid, cid)
         
         return JSONResponse(
             status_code=200,
@@ -320,9 +587,6 @@ async def upload_json_capture(
     - metadata: JSON string containing the full capture data (base64 images, depth data, signature, etc.)
     """
     try:
-        # Read image file
-        image_data = await image.read()
-        
         # Parse and validate metadata JSON
         try:
             metadata_dict = json.loads(metadata)
@@ -330,32 +594,36 @@ async def upload_json_capture(
             raise HTTPException(status_code=400, detail="Invalid JSON in metadata")
         
         # Upload original image to IPFS
+        # (wallet_address is client input - only keep filename-safe characters of its prefix)
         timestamp = int(time.time())
-        image_filename = f"original_{wallet_address[:10]}_{timestamp}.jpg"
-        print(f"📤 Uploading image to Pinata...")
-        image_cid = upload_to_ipfs(image_data, image_filename, {
+        wallet_tag = _UNSAFE_FILENAME_CHARS.sub("", wallet_address[:10])
+        image_filename = f"original_{wallet_tag}_{timestamp}.jpg"
+        logger.info("📤 Uploading image to Pinata...")
+        image_cid = await upload_to_ipfs(image, image_filename, {
             "wallet_address": wallet_address,
             "type": "original_image"
         })
-        print(f"✅ Image uploaded to IPFS - CID: {image_cid}")
+        logger.info("✅ Image uploaded to IPFS - CID: %s", image_cid)
         
         # Upload metadata JSON to IPFS (includes depth data, base64 images, signature)
         metadata_dict["wallet_address"] = wallet_address
         metadata_dict["image_cid"] = image_cid  # Link metadata to image
+        # Stdlib json round-trips exactly what the client sent (NaN/Infinity, integers beyond 64 bits),
+        # which orjson would rewrite or reject - the pinned document carries the capture signature
         json_bytes = json.dumps(metadata_dict, separators=(',', ':')).encode('utf-8')
-        json_filename = f"metadata_{wallet_address[:10]}_{timestamp}.json"
-        print(f"📤 Uploading metadata to Pinata...")
-        json_cid = upload_to_ipfs(json_bytes, json_filename, {
+        json_filename = f"metadata_{wallet_tag}_{timestamp}.json"
+        logger.info("📤 Uploading metadata to Pinata...")
+        json_cid = await upload_json_to_ipfs(json_bytes, json_filename, {
             "wallet_address": wallet_address,
             "type": "metadata",
             "image_cid": image_cid
         })
-        print(f"✅ Metadata uploaded to IPFS - CID: {json_cid}")
+        logger.info("✅ Metadata uploaded to IPFS - CID: %s", json_cid)
         
         # Store both CIDs in Supabase (wallet_address, image_cid, metadata_cid)
-        print(f"📤 Storing CIDs in Supabase...")
-        store_in_supabase(wallet_address, image_cid, json_cid)
-        print(f"✅ CIDs stored in Supabase - Image: {image_cid}, Metadata: {json_cid}")
+        logger.info("📤 Storing CIDs in Supabase...")
+        await store_in_supabase(wallet_address, image_cid, json_cid)
+        logger.info("✅ CIDs stored in Supabase - Image: %s, Metadata: %s", image_cid, json_cid)
         
         return JSONResponse(
             status_code=200,
@@ -377,5 +645,12 @@ async def upload_json_capture(
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8000"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Prefer the io_uring-based loop where available, otherwise uvloop
+    try:
+        import uringcore
+        asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+        loop = "none"
+    except ImportError:
+        loop = "uvloop"
+    uvicorn.run(app, host="0.0.0.0", port=port, loop=loop, http="httptools")
 
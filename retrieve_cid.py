@@ -2,11 +2,17 @@
 """
 Retrieve and display content from IPFS using Pinata gateway
 """
+import argparse
+import asyncio
+import aiofiles
 import requests
+import urllib3
 import json
 import base64
 import os
-import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from functools import lru_cache
 from dotenv import load_dotenv
 from PIL import Image
 import io
@@ -19,12 +25,18 @@ PINATA_API_KEY = os.getenv("PINATA_API_KEY")
 PINATA_SECRET_KEY = os.getenv("PINATA_SECRET_KEY")
 PINATA_JWT = os.getenv("PINATA_JWT")
 
-def retrieve_from_ipfs(cid: str):
+GATEWAY_TIMEOUT = 5
+CACHE_SIZE = 256
+PEEK_BYTES = 512
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Errors raised while reading a (streamed) response body
+_READ_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError)
+
+def _build_gateways(cid: str):
     """
-    Retrieve content from IPFS via Pinata gateway with authentication
-    Returns the content as bytes
+    Build the list of gateways to query for a CID (dedicated gateway first, then public)
     """
-    # Build list of gateways to try (authenticated first, then public)
     gateways = []
     
     # If we have JWT, try authenticated gateway first
@@ -37,92 +49,233 @@ def retrieve_from_ipfs(cid: str):
             "name": "Pinata Authenticated Gateway (JWT)"
         })
     
-    # Try public IPFS gateways as fallback
+    # Dedicated gateway without auth, then public IPFS gateways as fallback
     gateways.extend([
-        {"url": f"https://ipfs.io/ipfs/{cid}", "headers": {}, "name": "IPFS.io Public Gateway"},
+        {"url": f"https://{PINATA_GATEWAY}/ipfs/{cid}", "headers": {}, "name": "Custom Pinata Gateway"},
         {"url": f"https://gateway.pinata.cloud/ipfs/{cid}", "headers": {}, "name": "Pinata Public Gateway"},
-        {"url": f"https://dweb.link/ipfs/{cid}", "headers": {}, "name": "Protocol Labs dweb.link"},
-        {"url": f"https://{PINATA_GATEWAY}/ipfs/{cid}", "headers": {}, "name": "Custom Pinata Gateway"}
+        {"url": f"https://ipfs.io/ipfs/{cid}", "headers": {}, "name": "IPFS.io Public Gateway"},
+        {"url": f"https://dweb.link/ipfs/{cid}", "headers": {}, "name": "Protocol Labs dweb.link"}
     ])
+    return gateways
+
+def _fetch_gateway(gateway: dict, headers: dict):
+    """Fetch a CID from a single gateway, returning the (streamed) response"""
+    return requests.get(
+        gateway["url"],
+        headers={**gateway["headers"], **headers},
+        timeout=GATEWAY_TIMEOUT,
+        stream=True
+    )
+
+def _close_response(future):
+    """Close the response of a gateway request that lost the race"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _gateway_responses(cid: str, headers: dict = None, log=print):
+    """
+    Query all gateways in parallel and yield (name, response) for each successful response, fastest first
+    Response bodies are not read yet - the caller consumes and closes each one, and only advances
+    to the next gateway if reading the body fails
+    Progress lines are passed to log (print by default)
+    """
+    gateways = _build_gateways(cid)
+    log(f"📥 Retrieving CID: {cid}")
+    log(f"   Racing {len(gateways)} gateways")
     
-    for i, gateway in enumerate(gateways):
-        url = gateway["url"]
-        headers = gateway["headers"]
-        name = gateway.get("name", "Gateway")
-        
-        try:
-            if i == 0:
-                print(f"📥 Retrieving CID: {cid}")
-            print(f"   Trying: {name}")
-            
-            response = requests.get(url, headers=headers, timeout=30)
+    executor = ThreadPoolExecutor(max_workers=len(gateways))
+    futures = {executor.submit(_fetch_gateway, gateway, headers or {}): gateway for gateway in gateways}
+    try:
+        for future in as_completed(futures):
+            name = futures[future].get("name", "Gateway")
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                log(f"   ⚠ {name}: Error: {str(e)[:50]}")
+                continue
             
-            if response.status_code == 200:
-                print(f"   ✅ Success!\n")
-                return response.content
-            elif response.status_code == 403:
-                print(f"   ⚠ 403 Forbidden")
+            # 206 Partial Content is a success for ranged requests
+            if response.status_code in (200, 206):
+                log(f"   ✅ Success via {name}!\n")
+                yield name, response
                 continue
+            
+            response.close()
+            if response.status_code == 403:
+                log(f"   ⚠ {name}: 403 Forbidden")
             elif response.status_code == 404:
-                print(f"   ⚠ 404 Not Found")
-                continue
+                log(f"   ⚠ {name}: 404 Not Found")
             else:
-                print(f"   ⚠ Status {response.status_code}")
-                continue
-                
-        except requests.exceptions.RequestException as e:
-            print(f"   ⚠ Error: {str(e)[:50]}")
-            continue
+                log(f"   ⚠ {name}: Status {response.status_code}")
+    finally:
+        # Don't wait for the slower gateways once we have an answer - close their responses when they arrive
+        for future in futures:
+            future.add_done_callback(_close_response)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _report_read_error(name: str, error: Exception, log=print):
+    log(f"   ⚠ {name}: Read error: {str(error)[:50]} - trying next gateway")
+
+def _read_from_gateways(cid: str, read, headers: dict = None, log=print):
+    """
+    Return read(response) for the first gateway whose body can be read
+    Raises LookupError if no gateway returns the content
+    """
+    with closing(_gateway_responses(cid, headers, log)) as responses:
+        for name, response in responses:
+            try:
+                with response:
+                    return read(response)
+            except _READ_ERRORS as e:
+                _report_read_error(name, e, log)
+    raise LookupError(cid)
+
+def _report_not_found(log=print):
+    log(f"❌ Failed to retrieve CID from all gateways")
+    log(f"   The content may not be pinned yet, or the CID is invalid")
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _fetch_content(cid: str) -> bytes:
+    """Fetch the full content of a CID (only successes are cached - lru_cache does not store exceptions)"""
+    return _read_from_gateways(cid, lambda response: response.content)
+
+def retrieve_from_ipfs(cid: str):
+    """
+    Retrieve content from IPFS, racing the Pinata and public gateways
+    Results are cached in memory per CID
+    Returns the content as bytes, or None if no gateway has it
+    """
+    try:
+        return _fetch_content(cid)
+    except LookupError:
+        _report_not_found()
+        return None
+
+# Magic numbers, compared as a big-endian 32-bit word of the first 4 bytes
+_JPEG_MASK = 0xFFFFFF00  # JPEG only fixes the first 3 bytes (FF D8 FF)
+_JPEG_MAGIC = 0xFFD8FF00
+_PNG_MAGIC = 0x89504E47  # \x89PNG
+_JSON_FIRST_BYTES = (0x7B, 0x5B)  # { [
+_WHITESPACE = (0x20, 0x09, 0x0A, 0x0D)
+
+def detect_content_type(head: bytes):
+    """
+    Detect the content type from the first bytes of the content, without parsing the whole body
+    Returns "json", "unknown", or an image format name ("jpeg", "png", "gif", ...)
+    """
+    word = int.from_bytes(head[:4].ljust(4, b'\x00'), 'big')
+    if (word & _JPEG_MASK) == _JPEG_MAGIC:
+        return "jpeg"
+    if word == _PNG_MAGIC:
+        return "png"
+    first = word >> 24
+    if first in _WHITESPACE:
+        stripped = head.lstrip()
+        first = stripped[0] if stripped else 0
+    if first in _JSON_FIRST_BYTES:  # Likely JSON
+        return "json"
+    # Let PIL identify other image formats from the header alone
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            return img.format.lower()
+    except Exception:
+        return "unknown"
+
+def peek_content_type(cid: str, log=print):
+    """
+    Identify the content type of a CID from its first bytes, using a ranged request
+    Returns (content_type, first_bytes), or None if no gateway has it
+    """
+    # Gateways that ignore Range reply 200 with the full body - only read what we need
+    try:
+        head = _read_from_gateways(
+            cid,
+            lambda response: response.raw.read(PEEK_BYTES, decode_content=True),
+            {"Range": f"bytes=0-{PEEK_BYTES - 1}"},
+            log
+        )
+    except LookupError:
+        _report_not_found(log)
+        return None
+    return detect_content_type(head), head
+
+async def _write_file(filename: str, data: bytes):
+    """Write bytes to a file without blocking the event loop"""
+    async with aiofiles.open(filename, 'wb') as f:
+        await f.write(data)
+
+async def _stream_to_file(response: requests.Response, filename: str) -> int:
+    """Write a response body to a file chunk by chunk, returning the number of bytes written"""
+    size = 0
+    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+    async with aiofiles.open(filename, 'wb') as f:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            await f.write(chunk)
+            size += len(chunk)
+    return size
+
+async def download_to_file(cid: str, filename: str) -> int:
+    """
+    Stream the content of a CID to a file chunk by chunk
+    If a gateway fails mid-download, the partial file is removed and the next gateway is used
+    Returns the number of bytes written, or None if no gateway has it
+    """
+    with closing(_gateway_responses(cid)) as responses:
+        while (item := await asyncio.to_thread(next, responses, None)) is not None:
+            name, response = item
+            try:
+                with response:
+                    return await _stream_to_file(response, filename)
+            except _READ_ERRORS as e:
+                _report_read_error(name, e)
+                if os.path.exists(filename):
+                    os.remove(filename)
     
-    print(f"❌ Failed to retrieve CID from all gateways")
-    print(f"   The content may not be pinned yet, or the CID is invalid")
+    _report_not_found()
     return None
 
-def display_image(content: bytes, cid: str):
-    """Display image content"""
+def display_image(filename: str, cid: str, show: bool = False):
+    """
+    Display image content saved to filename
+    Format, size and mode come from the header - pixels are only decoded when show is set
+    """
     try:
-        img = Image.open(io.BytesIO(content))
-        print(f"✅ Image retrieved successfully!")
-        print(f"   Format: {img.format}")
-        print(f"   Size: {img.size[0]}x{img.size[1]} pixels")
-        print(f"   Mode: {img.mode}")
-        
-        # Save to file
-        filename = f"retrieved_{cid[:10]}.jpg"
-        with open(filename, 'wb') as f:
-            f.write(content)
-        print(f"   Saved to: {filename}\n")
-        
-        # Try to display (if running in environment that supports it)
-        try:
-            img.show()
-        except:
-            print(f"   (Image display not available in this environment)")
+        with Image.open(filename) as img:
+            print(f"✅ Image retrieved successfully!")
+            print(f"   Format: {img.format}")
+            print(f"   Size: {img.size[0]}x{img.size[1]} pixels")
+            print(f"   Mode: {img.mode}")
+            print(f"   Saved to: {filename}\n")
+            
+            # Try to display (if requested and the environment supports it)
+            if show:
+                try:
+                    img.show()
+                except:
+                    print(f"   (Image display not available in this environment)")
         
     except Exception as e:
         print(f"❌ Error processing image: {e}")
-        # Save raw bytes anyway
-        filename = f"retrieved_{cid[:10]}.bin"
-        with open(filename, 'wb') as f:
-            f.write(content)
-        print(f"   Saved raw content to: {filename}\n")
+        # Keep the raw bytes anyway
+        raw_filename = f"retrieved_{cid[:10]}.bin"
+        os.replace(filename, raw_filename)
+        print(f"   Saved raw content to: {raw_filename}\n")
 
-def display_json(content: bytes, cid: str):
+async def display_json(content: bytes, cid: str):
     """Display JSON content"""
     try:
-        # Try to decode as JSON
-        text = content.decode('utf-8')
-        data = json.loads(text)
+        # Parse the bytes directly (no intermediate str)
+        data = json.loads(content)
         
         print(f"✅ JSON retrieved successfully!")
         print(f"   Size: {len(content)} bytes")
         print(f"\n📄 JSON Content:\n")
-        print(json.dumps(data, indent=2))
+        pretty = json.dumps(data, indent=2)
+        print(pretty)
         
         # Save to file
         filename = f"retrieved_{cid[:10]}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        await _write_file(filename, pretty.encode('utf-8'))
         print(f"\n   Saved to: {filename}\n")
         
         # If it contains base64 images, try to extract them
@@ -147,26 +300,34 @@ def display_json(content: bytes, cid: str):
         print(content[:500].decode('utf-8', errors='ignore'))
         # Save raw content
         filename = f"retrieved_{cid[:10]}.txt"
-        with open(filename, 'wb') as f:
-            f.write(content)
+        await _write_file(filename, content)
         print(f"\n   Saved raw content to: {filename}\n")
     except Exception as e:
         print(f"❌ Error processing JSON: {e}")
         filename = f"retrieved_{cid[:10]}.bin"
-        with open(filename, 'wb') as f:
-            f.write(content)
+        await _write_file(filename, content)
         print(f"   Saved raw content to: {filename}\n")
 
-def main():
+def _prefetch_peek(cid: str):
+    """
+    Start peeking at a CID in a worker thread
+    Its progress output is buffered so it can be printed in order, once that CID's turn comes
+    """
+    output = []
+    task = asyncio.create_task(asyncio.to_thread(peek_content_type, cid, output.append))
+    return task, output
+
+async def main():
     # Test CIDs from user
     image_cid = "bafkreifuoydyklral6zubbjrirvvu5jdxr6dypemkppzxamnoxfwwja7lu"
     metadata_cid = "bafybeicozdjmw4t3h7ryknzkfxe2v4anh7ablo4tvhrqvcuxqpx63g4e6u"
     
     # Allow command line arguments
-    if len(sys.argv) > 1:
-        cids = sys.argv[1:]
-    else:
-        cids = [image_cid, metadata_cid]
+    parser = argparse.ArgumentParser(description="Retrieve and display content from IPFS")
+    parser.add_argument("cids", nargs="*", default=[image_cid, metadata_cid], help="CIDs to retrieve")
+    parser.add_argument("--show", action="store_true", help="open retrieved images in an image viewer")
+    args = parser.parse_args()
+    cids = args.cids
     
     print("="*70)
     print("IPFS Content Retriever")
@@ -176,50 +337,47 @@ def main():
         print(f"Using Pinata API authentication")
     print()
     
-    for cid in cids:
+    # Peek at the next CID while the current one is downloaded and written to disk
+    next_peek = _prefetch_peek(cids[0])
+    for i, cid in enumerate(cids):
         print("\n" + "="*70)
-        content = retrieve_from_ipfs(cid)
+        # Identify the content type from the first bytes before downloading everything
+        peek_task, peek_output = next_peek
+        peeked = await peek_task
+        for line in peek_output:
+            print(line)
+        if i + 1 < len(cids):
+            next_peek = _prefetch_peek(cids[i + 1])
         
-        if content is None:
+        if peeked is None:
             continue
+        content_type, head = peeked
         
-        # Try to determine content type
-        # Check if it's an image (JPEG, PNG, etc.)
-        if content.startswith(b'\xff\xd8\xff'):  # JPEG
-            print(f"📷 Detected: JPEG Image")
-            display_image(content, cid)
-        elif content.startswith(b'\x89PNG'):  # PNG
-            print(f"📷 Detected: PNG Image")
-            display_image(content, cid)
-        elif content.startswith(b'{') or content.startswith(b'['):  # Likely JSON
+        if content_type == "json":
             print(f"📄 Detected: JSON")
-            display_json(content, cid)
+            content = await asyncio.to_thread(retrieve_from_ipfs, cid)
+            if content is not None:
+                await display_json(content, cid)
+        elif content_type == "unknown":
+            print(f"⚠ Unknown content type")
+            filename = f"retrieved_{cid[:10]}.bin"
+            size = await download_to_file(cid, filename)
+            if size is not None:
+                print(f"   Size: {size} bytes")
+                print(f"   First 200 bytes (hex): {head[:200].hex()}")
+                print(f"   First 200 bytes (text): {head[:200].decode('utf-8', errors='ignore')}")
+                print(f"   Saved to: {filename}\n")
         else:
-            # Try JSON first
-            try:
-                text = content.decode('utf-8')
-                json.loads(text)
-                print(f"📄 Detected: JSON")
-                display_json(content, cid)
-            except:
-                # Try image
-                try:
-                    img = Image.open(io.BytesIO(content))
-                    print(f"📷 Detected: Image ({img.format})")
-                    display_image(content, cid)
-                except:
-                    print(f"⚠ Unknown content type")
-                    print(f"   Size: {len(content)} bytes")
-                    print(f"   First 200 bytes (hex): {content[:200].hex()}")
-                    print(f"   First 200 bytes (text): {content[:200].decode('utf-8', errors='ignore')}")
-                    filename = f"retrieved_{cid[:10]}.bin"
-                    with open(filename, 'wb') as f:
-                        f.write(content)
-                    print(f"   Saved to: {filename}\n")
+            # Images are streamed straight to disk
+            print(f"📷 Detected: {content_type.upper()} Image")
+            extension = "jpg" if content_type == "jpeg" else content_type
+            filename = f"retrieved_{cid[:10]}.{extension}"
+            if await download_to_file(cid, filename) is not None:
+                display_image(filename, cid, show=args.show)
     
     print("="*70)
     print("✅ Retrieval complete!")
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
 